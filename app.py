@@ -16,12 +16,27 @@ from docs_http200_examples import *
 
 from docs_error_examples import *
 
+from profiling import install_profiling, stage
+
+from recording import install_recording
+
 # --- Configuration & Initialization ---
 load_dotenv()
 
 AZURE_ENDPOINT = os.getenv("AZURE_ENDPOINT")
 AZURE_KEY = os.getenv("AZURE_KEY")
 
+# Opt-in request instrumentation (Server-Timing header, slow request log, /debug endpoints)
+PROFILING_ENABLED = os.getenv("PROFILING_ENABLED", "false").lower() in ("1", "true", "yes")
+PROFILING_SLOW_REQUESTS = int(os.getenv("PROFILING_SLOW_REQUESTS", "20"))
+
+# Opt-in traffic capture for offline replay (see replay.py)
+RECORDING_ENABLED = os.getenv("RECORDING_ENABLED", "false").lower() in ("1", "true", "yes")
+RECORDING_DIR = os.getenv("RECORDING_DIR", "recordings")
+RECORDING_SAMPLE_RATE = float(os.getenv("RECORDING_SAMPLE_RATE", "0.1"))
+RECORDING_MAX_BYTES = int(os.getenv("RECORDING_MAX_BYTES", str(50 * 1024 * 1024)))
+RECORDING_MAX_FILES = int(os.getenv("RECORDING_MAX_FILES", "10"))
+
 if not AZURE_ENDPOINT or not AZURE_KEY:
     print("Warning: AZURE_ENDPOINT or AZURE_KEY not set. Image analysis calls will fail.")
 
@@ -46,6 +61,22 @@ app = FastAPI(
     version="0.1.0",
 )
 
+if PROFILING_ENABLED:
+    install_profiling(app, slow_request_count=PROFILING_SLOW_REQUESTS)
+    print("Profiling enabled: Server-Timing headers and /debug endpoints are active.")
+
+if RECORDING_ENABLED:
+    client = install_recording(
+        app,
+        client,
+        directory=RECORDING_DIR,
+        sample_rate=RECORDING_SAMPLE_RATE,
+        max_bytes=RECORDING_MAX_BYTES,
+        max_files=RECORDING_MAX_FILES,
+        secrets=[AZURE_KEY],
+    )
+    print(f"Recording {RECORDING_SAMPLE_RATE:.0%} of requests to {RECORDING_DIR}/.")
+
 # --- Enums and Models ---
 
 
@@ -143,12 +174,14 @@ def _call_azure_analysis(image_url: str, features: List[VisualFeatures]) -> dict
     try:
         print(f"Analyzing {image_url} with features: {[f.name for f in features]}")
 
-        analysis = client.analyze_from_url(
-            image_url=image_url,
-            visual_features=features,
-        )
+        with stage("azure"):
+            analysis = client.analyze_from_url(
+                image_url=image_url,
+                visual_features=features,
+            )
 
-        return analysis.as_dict()
+        with stage("as_dict"):
+            return analysis.as_dict()
 
     except Exception as e:
         print(f"Azure Image Analysis Error: {e}")
@@ -271,27 +304,29 @@ async def crop_area_of_interest(request: CroppingRequest):
                 ),
             )
 
-        analysis = client.analyze_from_url(
-            image_url=str(request.image_url),
-            visual_features=[VisualFeatures.SMART_CROPS],
-            smart_crops_aspect_ratios=aspect_ratios_float,
-        )
+        with stage("azure"):
+            analysis = client.analyze_from_url(
+                image_url=str(request.image_url),
+                visual_features=[VisualFeatures.SMART_CROPS],
+                smart_crops_aspect_ratios=aspect_ratios_float,
+            )
 
         crop_regions_data = []
-        if analysis.smart_crops and analysis.smart_crops.list:
-            for r in analysis.smart_crops.list:
-                bbox = r.bounding_box
-                crop_regions_data.append(
-                    {
-                        "aspect_ratio": r.aspect_ratio,
-                        "bounding_box": {
-                            "x": bbox.x,
-                            "y": bbox.y,
-                            "width": bbox.width,
-                            "height": bbox.height,
-                        },
-                    }
-                )
+        with stage("build"):
+            if analysis.smart_crops and analysis.smart_crops.list:
+                for r in analysis.smart_crops.list:
+                    bbox = r.bounding_box
+                    crop_regions_data.append(
+                        {
+                            "aspect_ratio": r.aspect_ratio,
+                            "bounding_box": {
+                                "x": bbox.x,
+                                "y": bbox.y,
+                                "width": bbox.width,
+                                "height": bbox.height,
+                            },
+                        }
+                    )
 
         return {"result": {"crop_regions": crop_regions_data}}
 
@@ -333,10 +368,11 @@ async def categorize_batch(request: BatchCategorizeRequest):
         print(f"Analyzing tags for categorization: {url_str}")
 
         try:
-            analysis = client.analyze_from_url(
-                image_url=url_str,
-                visual_features=[VisualFeatures.TAGS],
-            )
+            with stage("azure"):
+                analysis = client.analyze_from_url(
+                    image_url=url_str,
+                    visual_features=[VisualFeatures.TAGS],
+                )
 
             if not analysis.tags or not analysis.tags.list:
                 failed_images[url_str] = "No tags returned by Azure."
@@ -0,0 +1,302 @@
+# profiling.py
+
+"""
+Opt-in request instrumentation for the Image Analysis API.
+
+When enabled (PROFILING_ENABLED=true), every request outside /debug gets:
+  - a `Server-Timing` header with a per-stage breakdown
+  - an entry in a ring buffer of the slowest N requests
+and two debug endpoints are mounted:
+  - GET /debug/slow_requests
+  - GET /debug/profile?seconds=30  (folded stacks, flamegraph.pl / speedscope compatible)
+
+Stages:
+  - validate   pydantic request validation, timed inside the route handler
+  - <custom>   blocks wrapped in `stage(name)` inside the endpoint (e.g. azure)
+  - serialize  response model validation and JSON serialization
+  - queue      everything not covered above: waiting on the event loop behind
+               other requests (e.g. blocking Azure calls), receiving the body,
+               and middleware
+  - total      the whole request as seen by the middleware
+
+Validation and serialization are only measured for routes created after
+`install_profiling` switches the app to `TimedRoute`. When disabled, no
+middleware, route class or routes are installed, and `stage()` costs a single
+ContextVar lookup per call.
+"""
+
+import asyncio
+import functools
+import heapq
+import itertools
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from fastapi import APIRouter, FastAPI, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse
+from fastapi.routing import APIRoute
+
+DEBUG_PREFIX = "/debug"
+
+_current_timer: ContextVar[Optional["RequestTimer"]] = ContextVar("request_timer", default=None)
+
+
+class RequestTimer:
+    """Collects stage durations (in ms) for a single request."""
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.start = time.perf_counter()
+        # Set by TimedRoute: FastAPI's route handler and the endpoint it calls.
+        self.route_start: Optional[float] = None
+        self.route_end: Optional[float] = None
+        self.endpoint_start: Optional[float] = None
+        self.endpoint_end: Optional[float] = None
+        self.stages: Dict[str, float] = {}
+
+    def add(self, name: str, duration_ms: float) -> None:
+        # Stages may repeat (e.g. one Azure call per URL in /categorize_batch), so sum them.
+        self.stages[name] = self.stages.get(name, 0.0) + duration_ms
+
+    def finish(self) -> Dict[str, float]:
+        """Derive the framework stages around the endpoint and return the full breakdown."""
+        end = time.perf_counter()
+        total = (end - self.start) * 1000
+        breakdown: Dict[str, float] = {}
+
+        if self.route_start is None or self.route_end is None:
+            breakdown.update(self.stages)
+            breakdown["total"] = total
+            return breakdown
+
+        if self.endpoint_start is not None and self.endpoint_end is not None:
+            breakdown["validate"] = (self.endpoint_start - self.route_start) * 1000
+            breakdown.update(self.stages)
+            breakdown["serialize"] = (self.route_end - self.endpoint_end) * 1000
+        else:
+            # Validation failed (422), so the endpoint never ran.
+            breakdown["validate"] = (self.route_end - self.route_start) * 1000
+            breakdown.update(self.stages)
+
+        breakdown["queue"] = max(0.0, total - sum(breakdown.values()))
+        breakdown["total"] = total
+        return breakdown
+
+
+@contextmanager
+def stage(name: str):
+    """Time a block of code as a named stage of the current request (no-op when disabled)."""
+    timer = _current_timer.get()
+    if timer is None:
+        yield
+        return
+
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        timer.add(name, (time.perf_counter() - t0) * 1000)
+
+
+def _mark_endpoint(func):
+    """Wrap an endpoint so the current timer knows where its body starts and ends."""
+
+    if asyncio.iscoroutinefunction(func):
+
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            timer = _current_timer.get()
+            if timer is None:
+                return await func(*args, **kwargs)
+
+            timer.endpoint_start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                timer.endpoint_end = time.perf_counter()
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def sync_wrapper(*args, **kwargs):
+        timer = _current_timer.get()
+        if timer is None:
+            return func(*args, **kwargs)
+
+        timer.endpoint_start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            timer.endpoint_end = time.perf_counter()
+
+    return sync_wrapper
+
+
+class TimedRoute(APIRoute):
+    """
+    APIRoute that times FastAPI's own work around the endpoint: request
+    validation before it and response serialization after it.
+    """
+
+    def __init__(self, path: str, endpoint, **kwargs):
+        super().__init__(path, _mark_endpoint(endpoint), **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def timed_route_handler(request: Request):
+            timer = _current_timer.get()
+            if timer is None:
+                return await handler(request)
+
+            # Receive the body up front so waiting for it counts as queueing, not validation.
+            await request.body()
+            timer.route_start = time.perf_counter()
+            try:
+                return await handler(request)
+            finally:
+                timer.route_end = time.perf_counter()
+
+        return timed_route_handler
+
+
+def format_server_timing(breakdown: Dict[str, float]) -> str:
+    return ", ".join(f"{name};dur={ms:.2f}" for name, ms in breakdown.items())
+
+
+class SlowRequestLog:
+    """Thread-safe ring buffer keeping the N slowest requests seen so far."""
+
+    def __init__(self, size: int):
+        self.size = size
+        self._heap: List[tuple] = []
+        self._counter = itertools.count()
+        self._lock = threading.Lock()
+
+    def record(self, method: str, path: str, status_code: int, breakdown: Dict[str, float]) -> None:
+        if self.size <= 0:
+            return
+
+        total = breakdown["total"]
+        with self._lock:
+            if len(self._heap) >= self.size and total <= self._heap[0][0]:
+                return
+            entry = {
+                "method": method,
+                "path": path,
+                "status_code": status_code,
+                "timestamp": time.time(),
+                "stages_ms": {name: round(ms, 3) for name, ms in breakdown.items()},
+            }
+            item = (total, next(self._counter), entry)
+            if len(self._heap) < self.size:
+                heapq.heappush(self._heap, item)
+            else:
+                heapq.heapreplace(self._heap, item)
+
+    def snapshot(self) -> List[Dict]:
+        with self._lock:
+            items = sorted(self._heap, key=lambda i: i[0], reverse=True)
+        return [entry for _, _, entry in items]
+
+
+# --- Sampling profiler ---
+
+_profile_lock = threading.Lock()
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+def sample_stacks(seconds: float, interval: float = 0.005) -> str:
+    """
+    Sample the stacks of all Python threads for `seconds` and return them in
+    folded format: one `frame;frame;frame count` line per unique stack.
+    """
+    own_id = threading.get_ident()
+    counts: Counter = Counter()
+    deadline = time.monotonic() + seconds
+
+    while time.monotonic() < deadline:
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            labels = []
+            while frame is not None:
+                labels.append(_frame_label(frame))
+                frame = frame.f_back
+            counts[";".join(reversed(labels))] += 1
+        time.sleep(interval)
+
+    return "\n".join(f"{stack} {count}" for stack, count in counts.most_common()) + "\n"
+
+
+# --- Wiring ---
+
+
+def install_profiling(app: FastAPI, slow_request_count: int = 20) -> None:
+    """
+    Attach the timing middleware and /debug endpoints to `app`. Call this before
+    registering routes so they are created as TimedRoute. A `slow_request_count`
+    of 0 disables the slow request log.
+    """
+    if slow_request_count < 0:
+        raise ValueError(f"slow_request_count must be >= 0, got {slow_request_count}")
+
+    app.router.route_class = TimedRoute
+    slow_log = SlowRequestLog(slow_request_count)
+
+    @app.middleware("http")
+    async def server_timing_middleware(request: Request, call_next):
+        # Keep the profiler's own long-running requests out of the timings and slow request log.
+        if request.url.path.startswith(DEBUG_PREFIX):
+            return await call_next(request)
+
+        timer = RequestTimer(request.method, request.url.path)
+        token = _current_timer.set(timer)
+        try:
+            response = await call_next(request)
+        finally:
+            _current_timer.reset(token)
+
+        breakdown = timer.finish()
+        response.headers["Server-Timing"] = format_server_timing(breakdown)
+        slow_log.record(timer.method, timer.path, response.status_code, breakdown)
+        return response
+
+    router = APIRouter(prefix=DEBUG_PREFIX, tags=["Debug"])
+
+    @router.get(
+        "/slow_requests",
+        summary="Slowest requests",
+        description=f"The {slow_request_count} slowest requests since startup, with per-stage timings in ms.",
+    )
+    async def slow_requests():
+        return {"result": {"requests": slow_log.snapshot()}}
+
+    @router.get(
+        "/profile",
+        response_class=PlainTextResponse,
+        summary="Sampling profiler",
+        description=(
+            "Samples all Python thread stacks for the given number of seconds and returns them "
+            "in folded format, ready for flamegraph.pl or speedscope."
+        ),
+    )
+    async def profile(seconds: float = Query(30, gt=0, le=300)):
+        if not _profile_lock.acquire(blocking=False):
+            raise HTTPException(status_code=409, detail="A profiling session is already running.")
+        try:
+            return await asyncio.to_thread(sample_stacks, seconds)
+        finally:
+            _profile_lock.release()
+
+    app.include_router(router)
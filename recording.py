@@ -0,0 +1,355 @@
+# recording.py
+
+"""
+Opt-in traffic capture for offline replay (see replay.py).
+
+When enabled (RECORDING_ENABLED=true), a sampled fraction of requests is
+appended to gzip-compressed JSONL files, one record per line:
+
+    {
+      "timestamp": 1734000000.123,
+      "method": "POST",
+      "path": "/analyze_image",
+      "query_string": "",
+      "sample_rate": 0.1,
+      "request_body": {...},
+      "status_code": 200,
+      "response_body": {...},
+      "duration_ms": 412.3,
+      "azure_calls": [
+        {"image_url": "...", "visual_features": ["tags"], "smart_crops_aspect_ratios": null,
+         "duration_ms": 405.1, "response": {...}, "error": null}
+      ]
+    }
+
+Query-string secrets (SAS signatures, tokens, keys) and the Azure key itself
+are redacted before anything is written. Converting Azure results,
+redaction and writing all happen on a background thread behind a bounded
+queue; if the queue is full the record is dropped rather than slowing down
+the request.
+"""
+
+import atexit
+import functools
+import gzip
+import json
+import os
+import queue
+import random
+import re
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import unquote, urlsplit, urlunsplit
+
+REDACTED = "REDACTED"
+
+# Query parameters that commonly carry credentials (Azure SAS, S3 presigned URLs, API keys).
+SENSITIVE_QUERY_PARAMS = {
+    "sig", "signature", "token", "access_token",
+    "key", "api_key", "apikey", "subscription-key", "x-amz-signature", "x-amz-credential",
+    "x-amz-security-token",
+}
+
+# Docs and profiler routes are not worth replaying, and /debug may not exist in the replay environment.
+UNRECORDED_PREFIXES = ("/debug", "/docs", "/redoc", "/openapi.json")
+
+_URL_RE = re.compile(r"https?://[^\s'\"<>]+")
+
+_current_record: ContextVar[Optional[Dict[str, Any]]] = ContextVar("traffic_record", default=None)
+
+
+class Redactor:
+    """Strips secrets out of recorded values."""
+
+    def __init__(self, secrets: List[str]):
+        self.secrets = [s for s in secrets if s]
+
+    @staticmethod
+    def redact_query(query: str) -> str:
+        """Redact sensitive parameters, rewriting only those so every other byte stays as sent."""
+        params = query.split("&")
+        redacted = []
+        for param in params:
+            name = param.partition("=")[0]
+            redacted.append(f"{name}={REDACTED}" if unquote(name).lower() in SENSITIVE_QUERY_PARAMS else param)
+        return query if redacted == params else "&".join(redacted)
+
+    def _redact_url(self, match: "re.Match") -> str:
+        url = match.group(0)
+        parts = urlsplit(url)
+        if not parts.query:
+            return url
+        query = self.redact_query(parts.query)
+        if query == parts.query:
+            return url
+        return urlunsplit(parts._replace(query=query))
+
+    def __call__(self, value: Any) -> Any:
+        if isinstance(value, str):
+            for secret in self.secrets:
+                value = value.replace(secret, REDACTED)
+            # URLs also show up inside longer text, e.g. Azure error messages.
+            return _URL_RE.sub(self._redact_url, value)
+        if isinstance(value, dict):
+            # /categorize_batch keys failed_images by URL.
+            return {self(k): self(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [self(v) for v in value]
+        return value
+
+
+class RotatingGzipWriter:
+    """
+    Non-blocking JSONL writer. Records are queued and written by a daemon
+    thread to `<directory>/traffic-<timestamp>.jsonl.gz`, rolling over to a
+    new file after `max_bytes` of uncompressed output and keeping at most
+    `max_files` files. `prepare`, if given, turns each queued record into
+    what gets written, on the writer thread.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        max_bytes: int,
+        max_files: int,
+        queue_size: int = 10000,
+        prepare: Optional[Callable[[Dict], Dict]] = None,
+    ):
+        self.directory = directory
+        self.prepare = prepare
+        self.max_bytes = max_bytes
+        self.max_files = max_files
+        self.dropped = 0
+        self._queue: "queue.Queue[Optional[Dict]]" = queue.Queue(maxsize=queue_size)
+        self._file = None
+        self._written = 0
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, name="traffic-recorder", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def write(self, record: Dict) -> None:
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def close(self) -> None:
+        """Flush queued records and stop the writer thread. Safe to call more than once."""
+        atexit.unregister(self.close)
+        if not self._thread.is_alive():
+            return
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _open_new_file(self) -> None:
+        if self._file:
+            self._file.close()
+        name = time.strftime("traffic-%Y%m%d-%H%M%S", time.gmtime()) + f"-{time.time_ns() % 10**9:09d}.jsonl.gz"
+        self._file = gzip.open(os.path.join(self.directory, name), "wt", encoding="utf-8")
+        self._written = 0
+        self._prune_old_files()
+
+    def _prune_old_files(self) -> None:
+        files = sorted(f for f in os.listdir(self.directory) if f.startswith("traffic-") and f.endswith(".jsonl.gz"))
+        for name in files[: max(0, len(files) - self.max_files)]:
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError as e:
+                print(f"Could not remove old recording {name}: {e}")
+
+    def _run(self) -> None:
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+            try:
+                if self.prepare:
+                    record = self.prepare(record)
+                if self._file is None or self._written >= self.max_bytes:
+                    self._open_new_file()
+                line = json.dumps(record, default=str) + "\n"
+                self._file.write(line)
+                self._written += len(line)
+                if self._queue.empty():
+                    self._file.flush()
+            except Exception as e:
+                print(f"Traffic recorder write error: {e}")
+
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+class RecordingClient:
+    """
+    Wraps an ImageAnalysisClient and attaches every Azure call (arguments,
+    latency and raw result) to the request currently being recorded.
+    Converting and redacting the result is left to the writer thread.
+    """
+
+    def __init__(self, client):
+        self._client = client
+
+    def analyze_from_url(self, image_url: str, visual_features, **kwargs):
+        record = _current_record.get()
+        if record is None:
+            return self._client.analyze_from_url(image_url=image_url, visual_features=visual_features, **kwargs)
+
+        call = {
+            "image_url": image_url,
+            "visual_features": [f.value for f in visual_features],
+            "smart_crops_aspect_ratios": kwargs.get("smart_crops_aspect_ratios"),
+            "duration_ms": None,
+            "response": None,
+            "error": None,
+        }
+        record["azure_calls"].append(call)
+
+        t0 = time.perf_counter()
+        try:
+            analysis = self._client.analyze_from_url(image_url=image_url, visual_features=visual_features, **kwargs)
+        except Exception as e:
+            call["duration_ms"] = (time.perf_counter() - t0) * 1000
+            call["error"] = str(e)
+            raise
+        call["duration_ms"] = (time.perf_counter() - t0) * 1000
+        call["response"] = analysis
+        return analysis
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+def _decode_json(body: bytes) -> Any:
+    if not body:
+        return None
+    try:
+        return json.loads(body)
+    except ValueError:
+        return body.decode("utf-8", errors="replace")
+
+
+def prepare_record(record: Dict, redactor: Redactor) -> Dict:
+    """Turn a raw captured record into its JSON-ready, redacted form (runs on the writer thread)."""
+    for call in record["azure_calls"]:
+        if call["response"] is not None:
+            call["response"] = call["response"].as_dict()
+    record["request_body"] = _decode_json(record["request_body"])
+    record["response_body"] = _decode_json(record["response_body"])
+    record["query_string"] = redactor.redact_query(record["query_string"])
+    return redactor(record)
+
+
+class RecordingMiddleware:
+    """ASGI middleware that captures sampled HTTP requests and responses (API routes only)."""
+
+    def __init__(self, app, writer: RotatingGzipWriter, sample_rate: float):
+        self.app = app
+        self.writer = writer
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["path"].startswith(UNRECORDED_PREFIXES)
+            or random.random() >= self.sample_rate
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        request_chunks: List[bytes] = []
+        response_chunks: List[bytes] = []
+        status = {"code": 500}
+
+        async def recv():
+            message = await receive()
+            if message["type"] == "http.request":
+                request_chunks.append(message.get("body", b""))
+            return message
+
+        async def snd(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            elif message["type"] == "http.response.body":
+                response_chunks.append(message.get("body", b""))
+            await send(message)
+
+        record = {
+            "timestamp": time.time(),
+            "method": scope["method"],
+            "path": scope["path"],
+            "query_string": scope["query_string"].decode("latin-1"),
+            "sample_rate": self.sample_rate,
+            "azure_calls": [],
+        }
+        token = _current_record.set(record)
+        t0 = time.perf_counter()
+        try:
+            await self.app(scope, recv, snd)
+        finally:
+            _current_record.reset(token)
+            record["duration_ms"] = (time.perf_counter() - t0) * 1000
+            record["request_body"] = b"".join(request_chunks)
+            record["status_code"] = status["code"]
+            record["response_body"] = b"".join(response_chunks)
+            self.writer.write(record)
+
+
+def install_recording(app, client, directory: str, sample_rate: float, max_bytes: int, max_files: int, secrets: List[str]):
+    """
+    Attach the recording middleware to `app` and return the wrapped Azure client.
+    The writer is available as `app.state.recording_writer` and is closed at exit.
+    """
+    redactor = Redactor(secrets)
+    writer = RotatingGzipWriter(
+        directory,
+        max_bytes=max_bytes,
+        max_files=max_files,
+        prepare=functools.partial(prepare_record, redactor=redactor),
+    )
+    app.add_middleware(RecordingMiddleware, writer=writer, sample_rate=sample_rate)
+    app.state.recording_writer = writer
+
+    if client is None:
+        return None
+    return RecordingClient(client)
+
+
+def load_records(paths: List[str]) -> List[Dict]:
+    """Read recorded traffic from .jsonl.gz / .jsonl files or directories, sorted by timestamp."""
+    files: List[str] = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(
+                os.path.join(path, f) for f in sorted(os.listdir(path)) if f.endswith((".jsonl.gz", ".jsonl"))
+            )
+        else:
+            files.append(path)
+
+    records: List[Dict] = []
+    for path in files:
+        opener = gzip.open if path.endswith(".gz") else open
+        try:
+            with opener(path, "rt", encoding="utf-8") as f:
+                for line_no, line in enumerate(f, start=1):
+                    if not line.strip():
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        record = None
+                    if not isinstance(record, dict) or not {"timestamp", "method", "path"} <= record.keys():
+                        print(f"Warning: skipping corrupt record at {path}:{line_no}.")
+                        continue
+                    records.append(record)
+        except EOFError:
+            # The newest file may still be open by a running recorder; keep what was read.
+            print(f"Warning: {path} is truncated, using the records read so far.")
+        except (OSError, UnicodeDecodeError) as e:
+            print(f"Warning: could not read {path}: {e}")
+
+    records.sort(key=lambda r: r["timestamp"])
+    return records
@@ -0,0 +1,168 @@
+# replay.py
+
+"""
+Replay traffic captured with RECORDING_ENABLED=true against the app, using a
+stub Azure client that serves the recorded Azure responses.
+
+Usage:
+    python replay.py recordings/                     # production arrival rate
+    python replay.py recordings/ --speed 4           # 4x production rate
+    python replay.py recordings/ --as-recorded       # only the sampled requests' own rate
+    python replay.py recordings/ --speed 0           # as fast as possible
+    python replay.py recordings/ --min-rps 50        # exit 1 if throughput drops below 50 req/s
+
+Recordings only hold RECORDING_SAMPLE_RATE of the traffic, so by default
+arrivals are compressed by 1/sample_rate to match the production request
+rate. By default each stubbed Azure call sleeps for its recorded duration, so the
+load shape (including the blocking Azure calls) matches production.
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional
+
+import httpx
+from azure.ai.vision.imageanalysis.models import ImageAnalysisResult
+
+from recording import load_records
+
+_recorded_calls: ContextVar[Optional[Iterator[Dict]]] = ContextVar("recorded_calls", default=None)
+
+
+class StubImageAnalysisClient:
+    """Serves the Azure responses recorded for the request being replayed, in order."""
+
+    def __init__(self, simulate_latency: bool = True):
+        self.simulate_latency = simulate_latency
+
+    def analyze_from_url(self, image_url: str, visual_features, **kwargs):
+        calls = _recorded_calls.get()
+        call = next(calls, None) if calls is not None else None
+        if call is None:
+            raise RuntimeError(f"No recorded Azure response left for {image_url}")
+
+        if self.simulate_latency and call.get("duration_ms"):
+            # The real client is synchronous, so block just like it would.
+            time.sleep(call["duration_ms"] / 1000)
+
+        if call.get("error"):
+            raise RuntimeError(call["error"])
+        return ImageAnalysisResult(call["response"])
+
+
+async def _replay_one(http: httpx.AsyncClient, record: Dict, scheduled: float, results: List[Dict]) -> None:
+    delay = scheduled - time.perf_counter()
+    if delay > 0:
+        await asyncio.sleep(delay)
+
+    _recorded_calls.set(iter(record.get("azure_calls", [])))
+    url = record["path"]
+    if record.get("query_string"):
+        url += "?" + record["query_string"]
+    response = await http.request(record["method"], url, json=record.get("request_body"))
+    results.append(
+        {
+            "path": record["path"],
+            # Measured from the scheduled arrival, not the send: the app shares this event loop,
+            # so time spent waiting behind earlier (blocking) requests is queueing a real client sees.
+            "latency_ms": (time.perf_counter() - scheduled) * 1000,
+            "status_code": response.status_code,
+            "expected_status_code": record.get("status_code"),
+        }
+    )
+
+
+async def replay(records: List[Dict], speed: float, simulate_latency: bool) -> Dict:
+    # Imported here so main() can configure the environment first.
+    import app as image_api
+
+    image_api.client = StubImageAnalysisClient(simulate_latency=simulate_latency)
+
+    start_ts = records[0]["timestamp"]
+    results: List[Dict] = []
+    transport = httpx.ASGITransport(app=image_api.app)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://replay") as http:
+        t0 = time.perf_counter()
+        await asyncio.gather(
+            *(
+                _replay_one(http, r, t0 + ((r["timestamp"] - start_ts) / speed if speed > 0 else 0), results)
+                for r in records
+            )
+        )
+        elapsed = time.perf_counter() - t0
+
+    latencies = sorted(r["latency_ms"] for r in results)
+    return {
+        "requests": len(results),
+        "elapsed_s": elapsed,
+        "throughput_rps": len(results) / elapsed if elapsed else 0.0,
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))],
+        "p99_ms": latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))],
+        "status_mismatches": [r for r in results if r["status_code"] != r["expected_status_code"]],
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Replay recorded traffic against the Image Analysis API.")
+    parser.add_argument("paths", nargs="+", help="Recording files (.jsonl.gz / .jsonl) or directories.")
+    parser.add_argument("--speed", type=float, default=1.0, help="Arrival rate multiplier; 0 sends everything at once.")
+    parser.add_argument(
+        "--as-recorded",
+        action="store_true",
+        help="Keep the recorded arrival times instead of scaling them up by 1/sample_rate.",
+    )
+    parser.add_argument("--no-azure-latency", action="store_true", help="Return stubbed Azure responses immediately.")
+    parser.add_argument("--min-rps", type=float, default=None, help="Exit with status 1 if throughput falls below this.")
+    args = parser.parse_args()
+
+    missing = [p for p in args.paths if not os.path.exists(p)]
+    if missing:
+        print(f"Recording path not found: {', '.join(missing)}")
+        return 1
+
+    records = load_records(args.paths)
+    if not records:
+        print("No recorded requests found.")
+        return 1
+
+    speed = args.speed
+    sample_rates = {r.get("sample_rate", 1.0) for r in records}
+    if not args.as_recorded and speed > 0:
+        if len(sample_rates) > 1:
+            print(f"Warning: recordings mix sample rates {sorted(sample_rates)}; scaling by the lowest.")
+        sample_rate = min(sample_rates)
+        if 0 < sample_rate < 1:
+            speed /= sample_rate
+            print(f"Recorded at a {sample_rate:.0%} sample rate; scaling arrivals by {1 / sample_rate:g}x.")
+
+    # Never re-record while replaying.
+    os.environ["RECORDING_ENABLED"] = "false"
+
+    print(f"Replaying {len(records)} requests at {speed:g}x ...")
+    summary = asyncio.run(replay(records, speed=speed, simulate_latency=not args.no_azure_latency))
+
+    print(f"Requests:       {summary['requests']}")
+    print(f"Elapsed:        {summary['elapsed_s']:.2f} s")
+    print(f"Throughput:     {summary['throughput_rps']:.2f} req/s")
+    print(f"Latency p50:    {summary['p50_ms']:.1f} ms")
+    print(f"Latency p95:    {summary['p95_ms']:.1f} ms")
+    print(f"Latency p99:    {summary['p99_ms']:.1f} ms")
+    print(f"Status changes: {len(summary['status_mismatches'])}")
+    for m in summary["status_mismatches"][:10]:
+        print(f"  {m['path']}: expected {m['expected_status_code']}, got {m['status_code']}")
+
+    if args.min_rps is not None and summary["throughput_rps"] < args.min_rps:
+        print(f"FAIL: throughput {summary['throughput_rps']:.2f} req/s is below {args.min_rps} req/s")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,139 @@
+# test_profiling.py
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from pydantic import BaseModel
+
+import profiling
+from profiling import SlowRequestLog, format_server_timing, install_profiling, stage
+
+
+class Item(BaseModel):
+    name: str
+
+
+def make_app(slow_request_count: int = 20) -> FastAPI:
+    test_app = FastAPI()
+    install_profiling(test_app, slow_request_count=slow_request_count)
+
+    @test_app.post("/items")
+    async def create_item(item: Item):
+        with stage("azure"):
+            pass
+        with stage("build"):
+            pass
+        return {"name": item.name}
+
+    @test_app.get("/sync")
+    def sync_endpoint():
+        with stage("azure"):
+            pass
+        return {}
+
+    return test_app
+
+
+def stage_names(response) -> list:
+    return [part.split(";")[0] for part in response.headers["Server-Timing"].split(", ")]
+
+
+# --- Server-Timing ---
+
+
+def test_server_timing_stages_in_order():
+    client = TestClient(make_app())
+
+    response = client.post("/items", json={"name": "cat"})
+
+    assert response.status_code == 200
+    assert stage_names(response) == ["validate", "azure", "build", "serialize", "queue", "total"]
+
+
+def test_server_timing_on_sync_endpoint():
+    client = TestClient(make_app())
+
+    assert stage_names(client.get("/sync")) == ["validate", "azure", "serialize", "queue", "total"]
+
+
+def test_validation_error_reports_validate_only():
+    client = TestClient(make_app())
+
+    response = client.post("/items", json={})
+
+    assert response.status_code == 422
+    assert stage_names(response) == ["validate", "queue", "total"]
+
+
+def test_debug_requests_are_not_timed_or_logged():
+    client = TestClient(make_app())
+    client.post("/items", json={"name": "cat"})
+
+    response = client.get("/debug/slow_requests")
+
+    assert "Server-Timing" not in response.headers
+    assert [r["path"] for r in response.json()["result"]["requests"]] == ["/items"]
+
+
+def test_format_server_timing():
+    assert format_server_timing({"azure": 1.234, "total": 2}) == "azure;dur=1.23, total;dur=2.00"
+
+
+def test_stage_is_noop_without_timer():
+    with stage("azure"):
+        pass
+
+
+# --- Slow request log ---
+
+
+def record(log: SlowRequestLog, path: str, total: float) -> None:
+    log.record("GET", path, 200, {"total": total})
+
+
+def test_slow_request_log_keeps_slowest_in_order():
+    log = SlowRequestLog(2)
+    for path, total in [("/a", 5.0), ("/b", 1.0), ("/c", 9.0), ("/d", 3.0)]:
+        record(log, path, total)
+
+    assert [r["path"] for r in log.snapshot()] == ["/c", "/a"]
+
+
+def test_slow_request_log_size_zero_is_disabled():
+    log = SlowRequestLog(0)
+    record(log, "/a", 5.0)
+
+    assert log.snapshot() == []
+
+
+def test_size_zero_app_still_serves_requests():
+    client = TestClient(make_app(slow_request_count=0))
+
+    assert client.post("/items", json={"name": "cat"}).status_code == 200
+    assert client.get("/debug/slow_requests").json() == {"result": {"requests": []}}
+
+
+def test_negative_size_is_rejected():
+    with pytest.raises(ValueError):
+        install_profiling(FastAPI(), slow_request_count=-1)
+
+
+# --- Profiler ---
+
+
+def test_profile_returns_folded_stacks():
+    client = TestClient(make_app())
+
+    response = client.get("/debug/profile", params={"seconds": 0.05})
+
+    assert response.status_code == 200
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in response.text.splitlines())
+
+
+def test_concurrent_profile_is_rejected():
+    client = TestClient(make_app())
+
+    with profiling._profile_lock:
+        response = client.get("/debug/profile", params={"seconds": 0.05})
+
+    assert response.status_code == 409
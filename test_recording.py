@@ -0,0 +1,184 @@
+# test_recording.py
+
+import gzip
+import importlib
+import json
+import os
+import time
+
+import pytest
+from azure.ai.vision.imageanalysis.models import ImageAnalysisResult, VisualFeatures
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from recording import (
+    REDACTED,
+    RecordingClient,
+    Redactor,
+    RotatingGzipWriter,
+    _current_record,
+    install_recording,
+    load_records,
+    prepare_record,
+)
+import replay
+from replay import StubImageAnalysisClient, _recorded_calls
+
+AZURE_RESPONSE = {
+    "modelVersion": "2023-10-01",
+    "metadata": {"width": 10, "height": 10},
+    "tagsResult": {"values": [{"name": "cat", "confidence": 0.9}]},
+}
+
+
+# --- Redaction ---
+
+
+def test_redacts_sensitive_query_params_only():
+    redact = Redactor([])
+    assert redact("https://h/a.jpg?w=1&sig=SECRET&Token=T") == f"https://h/a.jpg?w=1&sig={REDACTED}&Token={REDACTED}"
+
+
+def test_leaves_urls_without_secrets_byte_identical():
+    redact = Redactor([])
+    url = "https://h/iu/?u=https%3A%2F%2Fmedia%2Fa.jpg&f=1&nofb=1&ipt=abc"
+    assert redact(url) == url
+
+
+def test_redacts_urls_inside_text_and_dict_keys():
+    redact = Redactor(["AZUREKEY"])
+    value = {
+        "https://h/bad.jpg?sig=TOPSECRET": "Analysis failed: boom for https://h/bad.jpg?sig=TOPSECRET (key AZUREKEY)",
+        "nested": [{"https://h/x.jpg?key=K": None}],
+    }
+
+    redacted = json.dumps(redact(value))
+
+    assert "TOPSECRET" not in redacted
+    assert "AZUREKEY" not in redacted
+    assert "key=K" not in redacted
+    assert f"https://h/bad.jpg?sig={REDACTED}" in redacted
+
+
+def test_redact_query():
+    assert Redactor.redact_query("a=1&api_key=x&b") == f"a=1&api_key={REDACTED}&b"
+    assert Redactor.redact_query("a=%3A1") == "a=%3A1"
+
+
+# --- Rotation ---
+
+
+def test_writer_rotates_and_prunes_old_files(tmp_path):
+    writer = RotatingGzipWriter(str(tmp_path), max_bytes=1, max_files=2)
+    for i in range(5):
+        writer.write({"timestamp": i, "method": "GET", "path": "/health"})
+    writer.close()
+
+    files = sorted(os.listdir(tmp_path))
+    assert len(files) == 2
+    # Every record fills a file, so only the newest two survive.
+    assert [r["timestamp"] for r in load_records([str(tmp_path)])] == [3, 4]
+
+
+# --- Round trip ---
+
+
+class FakeAzureClient:
+    def analyze_from_url(self, image_url, visual_features, **kwargs):
+        if "fail" in image_url:
+            raise ValueError(f"boom for {image_url}")
+        return ImageAnalysisResult(AZURE_RESPONSE)
+
+
+@pytest.fixture
+def recorded_dir(tmp_path):
+    test_app = FastAPI()
+    client = install_recording(
+        test_app,
+        FakeAzureClient(),
+        directory=str(tmp_path),
+        sample_rate=1.0,
+        max_bytes=1024 * 1024,
+        max_files=5,
+        secrets=[],
+    )
+
+    @test_app.post("/tags")
+    async def tags(payload: dict):
+        try:
+            analysis = client.analyze_from_url(image_url=payload["url"], visual_features=[VisualFeatures.TAGS])
+            return {"top": analysis.tags.list[0].name}
+        except ValueError as e:
+            return {"error": str(e)}
+
+    with TestClient(test_app) as http:
+        http.post("/tags?sig=QS", json={"url": "https://h/a.jpg?sig=S1"})
+        http.post("/tags", json={"url": "https://fail/b.jpg?sig=S2"})
+
+    test_app.state.recording_writer.close()
+    return tmp_path
+
+
+def test_recorded_traffic_round_trips_through_stub_client(recorded_dir):
+    raw = b"".join(gzip.open(recorded_dir / f).read() for f in os.listdir(recorded_dir))
+    for secret in (b"S1", b"S2", b"QS"):
+        assert secret not in raw
+
+    ok, failed = load_records([str(recorded_dir)])
+    assert ok["query_string"] == f"sig={REDACTED}"
+    assert ok["sample_rate"] == 1.0
+    assert ok["response_body"] == {"top": "cat"}
+
+    stub = StubImageAnalysisClient(simulate_latency=False)
+
+    _recorded_calls.set(iter(ok["azure_calls"]))
+    analysis = stub.analyze_from_url(image_url=ok["request_body"]["url"], visual_features=[VisualFeatures.TAGS])
+    assert analysis.as_dict() == AZURE_RESPONSE
+
+    _recorded_calls.set(iter(failed["azure_calls"]))
+    with pytest.raises(RuntimeError, match=f"sig={REDACTED}"):
+        stub.analyze_from_url(image_url=failed["request_body"]["url"], visual_features=[VisualFeatures.TAGS])
+
+
+class SlowAsDictResult:
+    def as_dict(self):
+        time.sleep(0.2)
+        return AZURE_RESPONSE
+
+
+class SlowAsDictClient:
+    def analyze_from_url(self, image_url, visual_features, **kwargs):
+        return SlowAsDictResult()
+
+
+def test_recorded_azure_latency_excludes_conversion():
+    record = {"query_string": "", "request_body": b"", "response_body": b"", "azure_calls": []}
+    token = _current_record.set(record)
+    try:
+        RecordingClient(SlowAsDictClient()).analyze_from_url(
+            image_url="https://h/a.jpg?sig=S", visual_features=[VisualFeatures.TAGS]
+        )
+    finally:
+        _current_record.reset(token)
+
+    assert record["azure_calls"][0]["duration_ms"] < 100
+
+    prepared = prepare_record(record, Redactor([]))
+    assert prepared["azure_calls"][0]["response"] == AZURE_RESPONSE
+    assert prepared["azure_calls"][0]["image_url"] == f"https://h/a.jpg?sig={REDACTED}"
+
+
+def test_load_records_skips_corrupt_lines(tmp_path, capsys):
+    path = tmp_path / "traffic.jsonl"
+    path.write_text('{"timestamp": 1, "method": "GET", "path": "/health"}\nnot json\n[1]\n')
+
+    assert [r["path"] for r in load_records([str(path)])] == ["/health"]
+    assert "traffic.jsonl:2" in capsys.readouterr().out
+
+
+def test_importing_replay_leaves_environment_alone(monkeypatch):
+    monkeypatch.delenv("RECORDING_ENABLED", raising=False)
+
+    importlib.reload(replay)
+
+    assert "RECORDING_ENABLED" not in os.environ